@@ -1,18 +1,20 @@
 import logging
-import json
 import inspect
-from typing import get_type_hints
 from typed import name as _name, Dict, Str, Union
 from typed.models import MODEL, LAZY_MODEL
 from typed.mods.helper.func import _unwrap
 from api.mods.helper import (
     _set_api_name,
+    _compile_mids,
     _enforce_ip_block,
     _enforce_token_auth,
     _enforce_rate_limit,
     Error,
     Request,
-    _build_kwargs
+    _build_kwargs,
+    _handler_spec,
+    _type_hints,
+    _json_dumps
 )
 from api.mods.log import log
 from system import System
@@ -20,6 +22,17 @@ from system.mods.handler import HandlerInfo
 from api.mods.router import Router
 from api.mods.handler import Response, route, GET, POST, PUT, PATCH, DELETE
 
+_JSON_CONTENT_TYPE = (b"content-type", b"application/json; charset=utf-8")
+_ALL_METHODS = frozenset(("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"))
+_KIND_METHODS = {
+    "route":  _ALL_METHODS,
+    "get":    frozenset(("GET",)),
+    "post":   frozenset(("POST",)),
+    "put":    frozenset(("PUT",)),
+    "patch":  frozenset(("PATCH",)),
+    "delete": frozenset(("DELETE",)),
+}
+
 def _match_path_segments(template_segs, path_segs):
     """Match ('users', '{id}') against ('users', '123') -> params dict or None."""
     if len(template_segs) != len(path_segs):
@@ -74,20 +87,11 @@ class API(System):
             if not isinstance(info, HandlerInfo):
                 continue
 
-            kind = str(info.meta.get("kind", "")).lower()
-            if kind not in ("route", "get", "post", "put", "patch", "delete"):
+            allowed_methods = _KIND_METHODS.get(str(info.meta.get("kind", "")).lower())
+            if allowed_methods is None or method not in allowed_methods:
                 continue
 
-            if kind == "route":
-                allowed_methods = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
-            else:
-                allowed_methods = {kind.upper()}
-
-            if method not in allowed_methods:
-                continue
-
-            template_segs = list(info.path)
-            params = _match_path_segments(template_segs, path_segs)
+            params = _match_path_segments(info.path, path_segs)
             if params is not None:
                 return info, params
 
@@ -146,7 +150,7 @@ class API(System):
 
             func_to_inspect = _unwrap(target.func)
             sig = inspect.signature(func_to_inspect)
-            hints = get_type_hints(func_to_inspect)
+            hints = _type_hints(func_to_inspect)
 
             models = {}
             params_info = {}
@@ -229,18 +233,6 @@ class API(System):
         path_for_log = path if not qs_raw else f"{path}?{qs_raw}"
 
         client_log_done = False
-        body = b""
-        more_body = True
-        while more_body:
-            message = await receive()
-            mtype = message.get("type")
-            if mtype == "http.request":
-                body += message.get("body", b"")
-                more_body = message.get("more_body", False)
-            elif mtype == "http.disconnect":
-                break
-            else:
-                more_body = False
 
         try:
             info, route_params = self._find_matching_handler(method, path)
@@ -265,20 +257,25 @@ class API(System):
             query_string=query_string,
             headers=headers,
             path_params=route_params,
-            body=body,
+            body=None,
             client=client,
+            receive=receive,
         )
 
         path_is_help = ("/" + "/".join(info.path) if info.path else "/").startswith("/help")
         effective_mids = info.meta.get("mids") or self.mids
+        cmids = _compile_mids(effective_mids)
 
         try:
-            if not path_is_help and effective_mids:
-                _enforce_ip_block(request, effective_mids, status_code=None)
-                _enforce_token_auth(request, effective_mids)
-                _enforce_rate_limit(request, effective_mids)
-
-            kw = await _build_kwargs(info.func, request)
+            if cmids.active and not path_is_help:
+                if cmids.block is not None:
+                    _enforce_ip_block(request, cmids, status_code=None, ip=client_ip)
+                if cmids.auth is not None:
+                    _enforce_token_auth(request, cmids)
+                if cmids.limit is not None:
+                    _enforce_rate_limit(request, cmids, ip=client_ip)
+
+            kw = await _build_kwargs(_handler_spec(info.func), request)
             result = info.func(**kw)
             if inspect.isawaitable(result):
                 result = await result
@@ -290,9 +287,9 @@ class API(System):
             log.client(msg, router_name=client_ip)
             client_log_done = True
 
-            if effective_mids and not path_is_help:
+            if cmids.block is not None and not path_is_help:
                 try:
-                    _enforce_ip_block(request, effective_mids, status_code=exc.status_code)
+                    _enforce_ip_block(request, cmids, status_code=exc.status_code, ip=client_ip)
                 except Error as block_exc:
                     resp_model = Response(
                         status="failure",
@@ -325,9 +322,9 @@ class API(System):
             )
             client_log_done = True
 
-            if effective_mids and not path_is_help:
+            if cmids.block is not None and not path_is_help:
                 try:
-                    _enforce_ip_block(request, effective_mids, status_code=422)
+                    _enforce_ip_block(request, cmids, status_code=422, ip=client_ip)
                 except Error as block_exc:
                     resp_model = Response(
                         status="failure",
@@ -365,9 +362,9 @@ class API(System):
             )
             client_log_done = True
 
-            if effective_mids and not path_is_help:
+            if cmids.block is not None and not path_is_help:
                 try:
-                    _enforce_ip_block(request, effective_mids, status_code=500)
+                    _enforce_ip_block(request, cmids, status_code=500, ip=client_ip)
                 except Error as block_exc:
                     resp_model = Response(
                         status="failure",
@@ -435,7 +432,7 @@ class API(System):
             )
 
         try:
-            json.dumps(result)
+            _json_dumps(result)
             data = result
             return Response(
                 status="success",
@@ -475,10 +472,10 @@ class API(System):
                 "message": getattr(resp, "message", None),
             }
 
-        body_bytes = json.dumps(payload).encode("utf-8")
+        body_bytes = _json_dumps(payload)
         headers = [
-            (b"content-type", b"application/json; charset=utf-8"),
-            (b"content-length", str(len(body_bytes)).encode("ascii")),
+            _JSON_CONTENT_TYPE,
+            (b"content-length", b"%d" % len(body_bytes)),
         ]
 
         await send(
@@ -502,6 +499,7 @@ class API(System):
         port=8000,
         log_level='debug',
         app_import_string=None,
+        workers=1,
         **kwargs,
     ):
         from api.mods.server import run as run_builtin
@@ -517,7 +515,7 @@ class API(System):
         lvl = lvl_map.get(str(log_level).lower(), _logging.INFO)
         self._logger.setLevel(lvl)
 
-        run_builtin(self, host=host, port=port)
+        run_builtin(self, host=host, port=port, workers=workers)
 
 API.attach(handler=route,  name='route')
 API.attach(handler=GET,    name='GET')
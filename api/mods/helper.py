@@ -1,15 +1,30 @@
 import os
+import re
 import sys
+import hmac
 import inspect
-import logging
+import operator
 import json
+import time
 import asyncio
-from datetime import datetime, timedelta
-from urllib.parse import parse_qs
+import threading
+from collections import deque
+from urllib.parse import unquote_plus
 from http.cookies import SimpleCookie
 from typing import get_type_hints
 
-from typed import Any, TYPE, Str, Dict, List, Set, Nill
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from fast_query_parsers import parse_query_string as _fast_parse_qs
+except ImportError:
+    _fast_parse_qs = None
+
+from typed import Any, TYPE, Dict, List, Set, Nill, name as _type_name
+from typed.mods.models import validate
 from typed.mods.helper.func import (
     _hinted_domain,
     _hinted_codomain,
@@ -20,8 +35,62 @@ from typed.mods.helper.func import (
 blocked_ips = {}
 rate_limits = {}
 _auth_failures = {}
+_mids_cache = {}
+_handler_spec_cache = {}
+_sequence_kind_cache = {}
+_want_body_cache = {}
+_LOCK_SHARDS = 16
+_ip_locks = [threading.Lock() for _ in range(_LOCK_SHARDS)]
 _ROUTER_CLASS = None
+_MIDS_CLASSES = None
 _api_name = None
+_sys_path_key = None
+_sys_path_cache = ()
+_module_path_cache = {}
+_NUMERIC_ITEM_CASTS = {"Int": int, "Float": float}
+_JSON_START_BYTES = b'{["tfn-0123456789'
+_UNSET = object()
+_LITERAL_WORDS = {
+    "true": True, "True": True, "TRUE": True,
+    "false": False, "False": False, "FALSE": False,
+    "null": None, "Null": None, "NULL": None,
+    "none": None, "None": None, "NONE": None,
+}
+_AUTH_SCHEMES = frozenset(("token", "bearer"))
+_INT_RE = re.compile(r"[+-]?\d+")
+_FLOAT_RE = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_PARAM_SCALAR, _PARAM_REQUEST, _PARAM_BODY, _PARAM_BODY_MODEL = range(4)
+
+if orjson is not None:
+    # orjson only handles 64-bit integers: it reads longer literals as
+    # floats and refuses to encode them, so those go through stdlib json.
+    # 19 digits already reaches past -2**63. orjson also rejects NaN and
+    # Infinity, which stdlib json accepts, so decode errors are retried.
+    _LONG_DIGITS = re.compile(r"\d{19}")
+    _LONG_DIGITS_BYTES = re.compile(rb"\d{19}")
+
+    def _json_loads(data):
+        if isinstance(data, str):
+            long_digits = _LONG_DIGITS.search(data)
+        else:
+            long_digits = _LONG_DIGITS_BYTES.search(data)
+        if long_digits is not None:
+            return json.loads(data)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+    def _json_dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return json.dumps(obj).encode("utf-8")
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
 
 
 def _set_api_name(name):
@@ -29,6 +98,10 @@ def _set_api_name(name):
     _api_name = name
 
 
+def _ip_lock(ip):
+    return _ip_locks[hash(ip) & (_LOCK_SHARDS - 1)]
+
+
 def _get_router_class():
     global _ROUTER_CLASS
     if _ROUTER_CLASS is None:
@@ -40,46 +113,21 @@ def _get_router_class():
     return _ROUTER_CLASS
 
 
-def _build_logger(logger, formatter):
-    logger = logging.getLogger(logger)
-    logger.setLevel(logging.DEBUG)
-    logger.propagate = True
-    return logger
-
-
-def _truncate_router_name(name, maxlen):
-    if len(name) <= maxlen:
-        return name
-    if maxlen <= 3:
-        return name[:maxlen]
-    return name[: maxlen - 3] + "..."
-
-
-def _build_prefix(col_width, router_name=None) -> Str:
-    api_name = _api_name or "api"
-    api_part = f"[{api_name}]"
-    label = router_name or ""
-    if label:
-        label = _truncate_router_name(label, col_width)
-        router_bracket = f"[{label}]"
-    else:
-        router_bracket = "[]"
-
-    target_width = col_width + 2
-    spaces_after = max(0, target_width - len(router_bracket))
-    router_part = f"{router_bracket}{' ' * spaces_after}"
-
-    return f"{api_part} {router_part} "
+def _get_mids_classes():
+    global _MIDS_CLASSES
+    if _MIDS_CLASSES is None:
+        from api.mods.mids import Block, Auth, Token, Limit
+        _MIDS_CLASSES = (Block, Auth, Token, Limit)
+    return _MIDS_CLASSES
 
 
 def _unwrap(func):
     f = func
-    while hasattr(f, "func") and callable(getattr(f, "func")):
-        inner = getattr(f, "func")
-        if inner is f:
-            break
+    while True:
+        inner = getattr(f, "func", None)
+        if inner is None or inner is f or not callable(inner):
+            return f
         f = inner
-    return f
 
 
 class Error(Exception):
@@ -90,13 +138,84 @@ class Error(Exception):
         self.headers = headers or {}
 
 
+def _parse_query_string(qs):
+    """
+    Parse 'qs' into a dict of value lists, like
+    'parse_qs(qs, keep_blank_values=True)'. Percent/plus decoding
+    is skipped when the string contains neither character.
+    """
+    data = {}
+    if not qs:
+        return data
+    decode = "%" in qs or "+" in qs
+    for pair in qs.split("&"):
+        if not pair:
+            continue
+        key, _, value = pair.partition("=")
+        if decode:
+            key = unquote_plus(key)
+            value = unquote_plus(value)
+        values = data.get(key)
+        if values is None:
+            data[key] = [value]
+        else:
+            values.append(value)
+    return data
+
+
+def _parse_cookie_header(cookie_header):
+    """
+    Parse a Cookie header into a name -> value dict. Quoted values
+    still go through SimpleCookie; plain 'a=1; b=2' pairs are split
+    directly.
+    """
+    if '"' in cookie_header:
+        c = SimpleCookie()
+        c.load(cookie_header)
+        return {k: morsel.value for k, morsel in c.items()}
+    cookies = {}
+    for pair in cookie_header.split(";"):
+        eq = pair.find("=")
+        if eq < 0:
+            continue
+        key = pair[:eq].strip()
+        if key:
+            cookies[key] = pair[eq + 1:].strip()
+    return cookies
+
+
+def _parse_query_bytes(qs):
+    """
+    Parse raw query bytes with fast_query_parsers into the same
+    dict-of-lists shape as '_parse_query_string'. Only used for
+    plain ASCII input without percent-escapes, where both agree.
+    """
+    data = {}
+    if not qs:
+        return data
+    for key, value in _fast_parse_qs(qs, "&"):
+        values = data.get(key)
+        if values is None:
+            data[key] = [value]
+        else:
+            values.append(value)
+    return data
+
+
 class QueryParams:
     def __init__(self, query_string):
+        if _fast_parse_qs is not None:
+            raw = query_string
+            if not isinstance(raw, bytes):
+                raw = (raw or "").encode("utf-8", "surrogateescape")
+            if raw.isascii() and b"%" not in raw:
+                self._data = _parse_query_bytes(raw)
+                return
         if isinstance(query_string, bytes):
             qs = query_string.decode("ascii", "ignore")
         else:
             qs = query_string or ""
-        self._data = parse_qs(qs, keep_blank_values=True)
+        self._data = _parse_query_string(qs)
 
     def get(self, name, default = None):
         values = self._data.get(name)
@@ -115,96 +234,169 @@ class QueryParams:
 
 
 class Request:
-    def __init__(self, method, path, query_string, headers, path_params, body, client):
+    def __init__(self, method, path, query_string, headers, path_params, body, client, receive=None):
         self.method = method.upper()
         self.path = path
         self.query_params = QueryParams(query_string)
         self.path_params = path_params or {}
-        self._body = body or b""
+        self._receive = receive
+        self._chunks = []
+        self._body = None if receive is not None else (body or b"")
+        self._text = _UNSET
+        self._json = _UNSET
         self.client = client
 
-        hdrs = {}
-        if headers:
-            for name_b, value_b in headers:
-                name = name_b.decode("latin1").lower()
-                value = value_b.decode("latin1")
-                hdrs[name] = value
-        self.headers = hdrs
+        self.headers = {
+            name_b.decode("latin1").lower(): value_b.decode("latin1")
+            for name_b, value_b in headers
+        } if headers else {}
 
         cookie_header = self.headers.get("cookie")
         if cookie_header:
-            c = SimpleCookie()
-            c.load(cookie_header)
-            self.cookies = {k: morsel.value for k, morsel in c.items()}
+            self.cookies = _parse_cookie_header(cookie_header)
         else:
             self.cookies = {}
 
+    async def stream(self):
+        """
+        Yield the body chunks as they arrive from the ASGI 'receive'
+        channel. The body is only pulled from the client on demand.
+        """
+        if self._body is not None:
+            if self._body:
+                yield self._body
+            return
+        while self._receive is not None:
+            message = await self._receive()
+            mtype = message.get("type")
+            if mtype == "http.request":
+                chunk = message.get("body", b"")
+                if not message.get("more_body", False):
+                    self._receive = None
+                if chunk:
+                    self._chunks.append(chunk)
+                    yield chunk
+            else:
+                self._receive = None
+        self._body = b"".join(self._chunks)
+        self._chunks = []
+
     async def body(self):
+        if self._body is None:
+            async for _ in self.stream():
+                pass
         return self._body
 
-    async def json(self):
-        if not self._body:
-            return None
-        text = self._body.decode("utf-8", errors="ignore")
-        return json.loads(text)
-
+    async def text(self):
+        if self._text is _UNSET:
+            body = await self.body()
+            self._text = body.decode("utf-8", errors="ignore")
+        return self._text
 
-def _looks_like_json(s):
-    if not isinstance(s, str):
-        return False
-    t = s.strip()
-    return (t.startswith("{") and t.endswith("}")) or (t.startswith("[") and t.endswith("]"))
+    async def json(self):
+        if self._json is _UNSET:
+            body = await self.body()
+            self._json = _json_loads(body) if body else None
+        return self._json
 
 
 def _parse_literal(value):
     if not isinstance(value, str):
         return value
     s = value.strip()
-    low = s.lower()
-    if low in ("true", "false"):
-        return low == "true"
-    if low in ("null", "none"):
-        return None
-    try:
-        if (s.startswith(("+", "-")) and s[1:].isdigit()) or s.isdigit():
+    if not s:
+        return value
+    c = s[0]
+    if c in "tTfFnNiI":
+        hit = _LITERAL_WORDS.get(s, _UNSET)
+        if hit is not _UNSET:
+            return hit
+        if len(s) > 8:
+            return value
+        low = s.lower()
+        if low in ("true", "false"):
+            return low == "true"
+        if low in ("null", "none"):
+            return None
+        if low in ("nan", "inf", "infinity"):
+            return float(s)
+        return value
+    if c not in "+-.0123456789" and not c.isdigit():
+        return value
+    if _INT_RE.fullmatch(s):
+        try:
             return int(s)
-    except Exception:
-        pass
-    try:
+        except ValueError:
+            # beyond sys.get_int_max_str_digits(); parsed as float below
+            pass
+    if _FLOAT_RE.fullmatch(s):
         return float(s)
-    except Exception:
-        pass
+    if "_" in s or (c in "+-" and s[1:].lower() in ("nan", "inf", "infinity")):
+        try:
+            return float(s)
+        except ValueError:
+            pass
     return value
 
 
 def _parse_json_maybe(value):
-    if not isinstance(value, str):
+    if not isinstance(value, str) or not value:
         return value
-    if _looks_like_json(value):
-        try:
-            return json.loads(value)
-        except Exception:
+    c = value[0]
+    if c.isspace():
+        t = value.lstrip()
+        if not t:
             return value
-    return value
+        c = t[0]
+    if c != "{" and c != "[":
+        return value
+    try:
+        return _json_loads(value)
+    except Exception:
+        return value
+
+
+def _sequence_kind(ann):
+    """
+    Classify 'ann' by its typed name into (container, item cast):
+    container is tuple, set or None; item cast is int/float for
+    numeric sequences, else None. Cached per annotation object.
+    """
+    entry = _sequence_kind_cache.get(id(ann))
+    if entry is not None and entry[0] is ann:
+        return entry[1]
+
+    n = _type_name(ann) if ann is not None else ""
+    container = None
+    if n.startswith("Tuple(") or n == "Tuple":
+        container = tuple
+    elif n.startswith("Set(") or n == "Set":
+        container = set
+    cast = None
+    for prefix in ("List(", "Tuple(", "Set("):
+        if n.startswith(prefix) and n.endswith(")"):
+            cast = _NUMERIC_ITEM_CASTS.get(n[len(prefix):-1])
+            break
+
+    kind = (container, cast)
+    _sequence_kind_cache[id(ann)] = (ann, kind)
+    return kind
 
 
 def _maybe_cast_sequence_to_target(seq, ann):
-    try:
-        from typed import name
-    except Exception:
-        name = lambda x: str(x)
     if not isinstance(seq, list):
         return seq
-    n = name(ann) if ann is not None else ""
-    if n.startswith("Tuple(") or n == "Tuple":
-        return tuple(seq)
-    if n.startswith("Set(") or n == "Set":
-        return set(seq)
+    container = _sequence_kind(ann)[0]
+    if container is not None:
+        return container(seq)
     return seq
 
 
-def _parse_query_value(name, ann, request):
-    vals = request.query_params.getlist(name)
+def _numeric_item_cast(ann):
+    return _sequence_kind(ann)[1]
+
+
+def _parse_query_values(vals, ann):
     if len(vals) > 1:
         parsed = [_parse_literal(v) for v in vals]
         return _maybe_cast_sequence_to_target(parsed, ann)
@@ -215,6 +407,13 @@ def _parse_query_value(name, ann, request):
         if j is not v:
             return _maybe_cast_sequence_to_target(j, ann)
         if "," in v:
+            cast = _numeric_item_cast(ann)
+            if cast is not None:
+                try:
+                    parsed = [cast(p) for p in v.split(",")]
+                    return _maybe_cast_sequence_to_target(parsed, ann)
+                except ValueError:
+                    pass
             parts = [p for p in v.split(",")]
             parsed = [_parse_literal(p) for p in parts]
             return _maybe_cast_sequence_to_target(parsed, ann)
@@ -231,40 +430,102 @@ async def _read_body(request):
         body_bytes = await request.body()
         if not body_bytes:
             return None
-        text = body_bytes.decode("utf-8", errors="ignore")
-        try:
-            return json.loads(text)
-        except Exception:
-            return text
+        head = body_bytes.lstrip()[:1]
+        if head and head in _JSON_START_BYTES:
+            try:
+                return _json_loads(body_bytes)
+            except Exception:
+                pass
+        return await request.text()
     except Exception:
         return None
 
 
 def _want_body_for(param_name, ann):
-    if ann is Nill or ann is inspect._empty:
+    if ann is None or ann is Nill or ann is inspect._empty:
         return False
-    if getattr(ann, "is_model", False):
-        return True
-    if ann <= Set or ann <= List or ann <= Dict:
-        return True
-    return False
+    entry = _want_body_cache.get(id(ann))
+    if entry is not None and entry[0] is ann:
+        return entry[1]
+    want = bool(
+        getattr(ann, "is_model", False)
+        or ann <= Set or ann <= List or ann <= Dict
+    )
+    _want_body_cache[id(ann)] = (ann, want)
+    return want
+
+
+def _type_hints(target):
+    """
+    Return the annotations of 'target'. They are read directly from
+    '__annotations__'; 'get_type_hints' only runs when some entry still
+    needs resolving (string forward refs or a bare None).
+    """
+    annotations = getattr(target, "__annotations__", None) or {}
+    for ann in annotations.values():
+        if ann is None or isinstance(ann, str):
+            break
+    else:
+        return annotations
+    try:
+        return get_type_hints(target)
+    except Exception:
+        return annotations
 
 
-async def _build_kwargs(func, request):
-    target = _unwrap(func)
+class _HandlerSpec:
+    """
+    Parameter descriptor of a handler, resolved once from its signature
+    and type hints. 'params' holds (name, lowered name, annotation,
+    default, source) entries in signature order, where source is one of
+    the _PARAM_* kinds.
+    """
+    __slots__ = ("params",)
 
-    sig = inspect.signature(target)
-    try:
-        hints = get_type_hints(target)
-    except TypeError:
-        # Fallback if typing.get_type_hints doesn't accept the object
-        hints = getattr(target, "__annotations__", {}) or {}
-    except Exception:
-        hints = getattr(target, "__annotations__", {}) or {}
+    def __init__(self, params):
+        self.params = params
 
-    params = sig.parameters
+
+def _handler_spec(func):
+    """
+    Return the _HandlerSpec used by '_build_kwargs' for 'func'.
+    Computed once per handler, so '_unwrap' never runs on the
+    request path.
+    """
+    entry = _handler_spec_cache.get(id(func))
+    if entry is not None and entry[0] is func:
+        return entry[1]
+
+    target = _unwrap(func)
+    hints = _type_hints(target)
+
+    params = []
+    for name, p in inspect.signature(target).parameters.items():
+        ann = hints.get(name)
+        if name == "request":
+            source = _PARAM_REQUEST
+        elif getattr(ann, "is_model", False):
+            source = _PARAM_BODY_MODEL
+        elif _want_body_for(name, ann):
+            source = _PARAM_BODY
+        else:
+            source = _PARAM_SCALAR
+        params.append((
+            sys.intern(name),
+            sys.intern(name.lower()),
+            ann,
+            p.default,
+            source,
+        ))
+    spec = _HandlerSpec(tuple(params))
+    _handler_spec_cache[id(func)] = (func, spec)
+    return spec
+
+
+async def _build_kwargs(spec, request):
     path_params = request.path_params or {}
-    headers = {k.lower(): v for k, v in request.headers.items()}
+    query = request.query_params._data
+    headers = request.headers
     cookies = request.cookies or {}
 
     body_loaded = False
@@ -272,58 +533,47 @@ async def _build_kwargs(func, request):
 
     kw = {}
 
-    # helper for nice type names
-    try:
-        from typed import name as _type_name
-    except Exception:
-        _type_name = lambda x: str(x)
-
-    for name, p in params.items():
-        if name == "request":
+    for name, name_lower, ann, default, source in spec.params:
+        if source == _PARAM_REQUEST:
             kw[name] = request
             continue
 
-        ann = hints.get(name)
-
         # Path params
-        if name in path_params:
-            value = path_params[name]
-            kw[name] = _parse_literal(_parse_json_maybe(value))
+        v = path_params.get(name, _UNSET)
+        if v is not _UNSET:
+            kw[name] = _parse_literal(_parse_json_maybe(v))
             continue
 
         # Query params
-        if name in request.query_params:
-            kw[name] = _parse_query_value(name, ann, request)
+        vals = query.get(name)
+        if vals is not None:
+            kw[name] = _parse_query_values(vals, ann)
             continue
 
         # Headers
-        if name.lower() in headers:
-            v = headers[name.lower()]
-            v = _parse_json_maybe(v)
-            kw[name] = _parse_literal(v)
+        v = headers.get(name_lower)
+        if v is not None:
+            kw[name] = _parse_literal(_parse_json_maybe(v))
             continue
 
         # Cookies
-        if name in cookies:
-            v = cookies[name]
-            v = _parse_json_maybe(v)
-            kw[name] = _parse_literal(v)
+        v = cookies.get(name)
+        if v is not None:
+            kw[name] = _parse_literal(_parse_json_maybe(v))
             continue
 
         # Body (JSON / text)
-        if _want_body_for(name, ann):
+        if source != _PARAM_SCALAR:
             if not body_loaded:
                 body_loaded = True
                 body_value = await _read_body(request)
 
-            if getattr(ann, "is_model", False):
+            if source == _PARAM_BODY_MODEL:
                 if not isinstance(body_value, dict):
                     raise TypeError(
                         f"Body for '{name}' must be a JSON object "
                         f"for model '{getattr(ann, '__name__', str(ann))}'"
                     )
-                from typed.mods.models import validate
-
                 entity = validate(body_value, ann)
                 kw[name] = ann(**entity)
             else:
@@ -331,8 +581,8 @@ async def _build_kwargs(func, request):
             continue
 
         # Default or required
-        if p.default is not inspect._empty:
-            kw[name] = p.default
+        if default is not inspect._empty:
+            kw[name] = default
         else:
             # Missing required parameter -> explicit API Error with type info
             if ann is not None:
@@ -350,114 +600,167 @@ async def _build_kwargs(func, request):
 # -------------------------------------
 # Middlewares (IP block, token auth)
 # -------------------------------------
-def _enforce_ip_block(request, mids, status_code=None):
-    from api.mods.mids import Block
+class _CompiledMids:
+    """
+    Route middlewares resolved once from a mids list: the selected
+    Block/Auth/Limit instances plus the values the enforcers need,
+    already coerced.
+    """
+    __slots__ = (
+        "block", "block_codes", "block_interval", "block_attempts", "block_seconds",
+        "auth", "token",
+        "limit", "limit_count", "limit_block_seconds",
+        "active",
+    )
+
+    def __init__(self, block=None, auth=None, limit=None):
+        self.block = block
+        self.block_codes = frozenset()
+        self.block_interval = self.block_attempts = self.block_seconds = None
+        if block is not None:
+            raw_codes = getattr(block, "codes", None)
+            if raw_codes is None:
+                codes = ()
+            elif isinstance(raw_codes, (list, tuple, set)):
+                codes = [int(c) for c in raw_codes]
+            else:
+                try:
+                    codes = [int(c) for c in list(raw_codes)]
+                except TypeError:
+                    codes = [int(raw_codes)]
+            self.block_codes = frozenset(codes)
+            self.block_interval = int(block.interval)
+            self.block_attempts = int(block.attempts)
+            if block.block_minutes < 0:
+                self.block_seconds = None
+            else:
+                self.block_seconds = int(block.block_minutes) * 60
 
-    if not mids:
-        return
+        self.auth = auth
+        self.token = None
+        if auth is not None:
+            Token = _get_mids_classes()[2]
+            if isinstance(auth, Token):
+                self.token = auth.token.encode("utf-8")
 
-    block_mid = None
-    for m in mids:
-        if isinstance(m, Block):
-            block_mid = m
-            break
+        self.limit = limit
+        self.limit_count = self.limit_block_seconds = None
+        if limit is not None:
+            self.limit_count = int(limit.limit)
+            self.limit_block_seconds = int(limit.block_minutes) * 60
 
-    if block_mid is None:
-        return
+        self.active = block is not None or auth is not None or limit is not None
 
-    # Determine client IP
-    client = getattr(request, "client", None)
-    if isinstance(client, tuple) and client:
-        ip = client[0]
-    else:
-        ip = "unknown"
 
-    now = datetime.now()
+_NO_MIDS = _CompiledMids()
 
-    info = blocked_ips.get(ip)
-    if info is not None:
-        blocked_until = info.get("blocked_until")
-        if blocked_until is None or blocked_until > now:
-            raise Error(
-                status_code=403,
-                detail=info.get("message", block_mid.message),
-            )
-        else:
-            blocked_ips.pop(ip, None)
-            _auth_failures.pop(ip, None)
 
-    if status_code is None:
-        return
+def _compile_mids(mids):
+    """
+    Return the _CompiledMids for 'mids'. Compiled once per mids list;
+    later calls hit a cache, which is rebuilt if the list's contents
+    have changed since it was compiled.
+    """
+    if not mids:
+        return _NO_MIDS
 
-    raw_codes = getattr(block_mid, "codes", None)
+    entry = _mids_cache.get(id(mids))
+    if entry is not None and entry[0] is mids:
+        snapshot = entry[1]
+        if len(snapshot) == len(mids) and all(map(operator.is_, snapshot, mids)):
+            return entry[2]
 
-    if raw_codes is None:
-        return
+    Block, Auth, _, Limit = _get_mids_classes()
 
-    if isinstance(raw_codes, (list, tuple, set)):
-        codes = [int(c) for c in raw_codes]
-    else:
-        try:
-            codes = [int(c) for c in list(raw_codes)]
-        except TypeError:
-            codes = [int(raw_codes)]
+    block_mid = auth_mid = limit_mid = None
+    for m in mids:
+        if block_mid is None and isinstance(m, Block):
+            block_mid = m
+        elif auth_mid is None and isinstance(m, Auth):
+            auth_mid = m
+        elif limit_mid is None and isinstance(m, Limit):
+            limit_mid = m
+
+    compiled = _CompiledMids(block_mid, auth_mid, limit_mid)
+    _mids_cache[id(mids)] = (mids, tuple(mids), compiled)
+    return compiled
+
+
+def _client_ip(request):
+    client = getattr(request, "client", None)
+    if isinstance(client, tuple) and client:
+        return client[0]
+    return "unknown"
 
-    if not codes:
-        return
 
-    if status_code not in codes:
+def _enforce_ip_block(request, cmids, status_code=None, ip=None):
+    block_mid = cmids.block
+    if block_mid is None:
         return
 
-    window_start = now - timedelta(seconds=int(block_mid.interval))
-    failures = _auth_failures.setdefault(ip, [])
-    failures[:] = [t for t in failures if t >= window_start]
-    failures.append(now)
+    if ip is None:
+        ip = _client_ip(request)
 
-    if len(failures) >= int(block_mid.attempts):
-        if block_mid.block_minutes < 0:
-            blocked_until = None
-        elif block_mid.block_minutes == 0:
-            blocked_until = now
-        else:
-            blocked_until = now + timedelta(minutes=int(block_mid.block_minutes))
-
-        blocked_ips[ip] = {
-            "blocked_until": blocked_until,
-            "message": block_mid.message,
-            "reason": getattr(block_mid, "reason", None),
-        }
-        _auth_failures.pop(ip, None)
-
-        raise Error(
-            status_code=403,
-            detail=block_mid.message,
-        )
+    with _ip_lock(ip):
+        now = time.monotonic()
 
+        info = blocked_ips.get(ip)
+        if info is not None:
+            blocked_until = info.get("blocked_until")
+            if blocked_until is None or blocked_until > now:
+                raise Error(
+                    status_code=403,
+                    detail=info.get("message", block_mid.message),
+                )
+            else:
+                blocked_ips.pop(ip, None)
+                _auth_failures.pop(ip, None)
+
+        if status_code is None:
+            return
+
+        if status_code not in cmids.block_codes:
+            return
+
+        window_start = now - cmids.block_interval
+        failures = _auth_failures.get(ip)
+        if failures is None:
+            failures = _auth_failures[ip] = deque()
+        while failures and failures[0] < window_start:
+            failures.popleft()
+        failures.append(now)
+
+        if len(failures) >= cmids.block_attempts:
+            if cmids.block_seconds is None:
+                blocked_until = None
+            else:
+                blocked_until = now + cmids.block_seconds
 
-def _enforce_token_auth(request, mids):
-    from api.mods.mids import Auth, Token
+            blocked_ips[ip] = {
+                "blocked_until": blocked_until,
+                "message": block_mid.message,
+                "reason": getattr(block_mid, "reason", None),
+            }
+            _auth_failures.pop(ip, None)
 
-    if not mids:
-        return
+            raise Error(
+                status_code=403,
+                detail=block_mid.message,
+            )
 
-    auth_mid = None
-    for m in mids:
-        if isinstance(m, Auth):
-            auth_mid = m
-            break
 
-    if auth_mid is None:
+def _enforce_token_auth(request, cmids):
+    if cmids.auth is None:
         return
 
-    if isinstance(auth_mid, Token):
-        expected = auth_mid.token
-
+    expected = cmids.token
+    if expected is not None:
         got = None
         auth_header = request.headers.get("authorization")
         if auth_header:
-            parts = auth_header.strip().split(None, 1)
-            if len(parts) == 2 and parts[0].lower() in ("token", "bearer"):
-                got = parts[1].strip()
+            scheme, _, rest = auth_header.strip().partition(" ")
+            if rest and scheme.lower() in _AUTH_SCHEMES:
+                got = rest.lstrip()
 
         if not got:
             got = request.headers.get("x-api-token")
@@ -465,7 +768,7 @@ def _enforce_token_auth(request, mids):
         if not got:
             got = request.query_params.get("token")
 
-        if not got or got != expected:
+        if not got or not hmac.compare_digest(got.encode("utf-8"), expected):
             raise Error(
                 status_code=401,
                 detail="Unauthorized",
@@ -475,68 +778,45 @@ def _enforce_token_auth(request, mids):
 
     raise Error(status_code=500, detail="Unsupported authentication type")
 
-def _enforce_rate_limit(request, mids):
-    from api.mods.mids import Limit
-    from datetime import datetime, timedelta
-
-    if not mids:
-        return
-
-    limit_mid = None
-    for m in mids:
-        if isinstance(m, Limit):
-            limit_mid = m
-            break
-
+def _enforce_rate_limit(request, cmids, ip=None):
+    limit_mid = cmids.limit
     if limit_mid is None:
         return
 
-    client = getattr(request, "client", None)
-    if isinstance(client, tuple) and client:
-        ip = client[0]
-    else:
-        ip = "unknown"
-
-    now = datetime.now()
-
-    ip_record = rate_limits.get(ip, {})
-    if "blocked_until" in ip_record:
-        if ip_record["blocked_until"] > now:
-            raise Error(
-                status_code=429,
-                detail=ip_record.get("message", limit_mid.message),
-            )
-        else:
-            if ip in rate_limits:
-                remaining_timestamps = ip_record.get("timestamps", [])
-                window_start = now - timedelta(minutes=1)
-                remaining_timestamps = [t for t in remaining_timestamps if t >= window_start]
-                rate_limits[ip] = {"timestamps": remaining_timestamps}
-            else:
-                rate_limits[ip] = {"timestamps": []}
+    if ip is None:
+        ip = _client_ip(request)
 
-    timestamps = ip_record.get("timestamps", [])
+    with _ip_lock(ip):
+        now = time.monotonic()
+        window_start = now - 60
 
-    window_start = now - timedelta(minutes=1)
-    timestamps = [t for t in timestamps if t >= window_start]
+        record = rate_limits.get(ip)
+        if record is None:
+            record = rate_limits[ip] = {"timestamps": deque()}
 
-    timestamps.append(now)
+        blocked_until = record.get("blocked_until")
+        if blocked_until is not None:
+            if blocked_until > now:
+                raise Error(
+                    status_code=429,
+                    detail=record.get("message", limit_mid.message),
+                )
+            record.pop("blocked_until", None)
+            record.pop("message", None)
 
-    ip_record["timestamps"] = timestamps
-    rate_limits[ip] = ip_record
+        timestamps = record["timestamps"]
+        while timestamps and timestamps[0] < window_start:
+            timestamps.popleft()
+        timestamps.append(now)
 
-    if len(timestamps) > int(limit_mid.limit):
-        blocked_until = now + timedelta(minutes=int(limit_mid.block_minutes))
-        rate_limits[ip] = {
-            "timestamps": timestamps,
-            "blocked_until": blocked_until,
-            "message": limit_mid.message
-        }
+        if len(timestamps) > cmids.limit_count:
+            record["blocked_until"] = now + cmids.limit_block_seconds
+            record["message"] = limit_mid.message
 
-        raise Error(
-            status_code=429,
-            detail=limit_mid.message,
-        )
+            raise Error(
+                status_code=429,
+                detail=limit_mid.message,
+            )
 
 
 # ------------------------
@@ -553,19 +833,26 @@ def _make_handler(func, method, mids=None):
     """
     original = _unwrap(func)
     sig = inspect.signature(original)
+    spec = _handler_spec(original)
     param_names = [
         name
         for name, p in sig.parameters.items()
         if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)
     ]
+    # _build_kwargs fills kw in signature order, so without *args/**kwargs
+    # its values already line up with param_names.
+    plain_params = len(param_names) == len(sig.parameters)
 
     expected_domain = _hinted_domain(original)
     expected_codomain = _hinted_codomain(original)
     is_async = inspect.iscoroutinefunction(original)
 
     async def handler(request: Request):
-        kw = await _build_kwargs(original, request)
-        args_list = [kw[name] for name in param_names if name in kw]
+        kw = await _build_kwargs(spec, request)
+        if plain_params:
+            args_list = list(kw.values())
+        else:
+            args_list = [kw[name] for name in param_names if name in kw]
 
         _check_domain(original, param_names, expected_domain, None, args_list)
 
@@ -587,8 +874,60 @@ def _make_handler(func, method, mids=None):
     return handler
 
 
+def _sys_path_prefixes():
+    """
+    Return (absolute entry, entry + os.sep) pairs for sys.path,
+    rebuilt only when sys.path changes.
+    """
+    global _sys_path_key, _sys_path_cache
+    key = tuple(sys.path)
+    if key != _sys_path_key:
+        _sys_path_cache = tuple(
+            (sp, sp + os.sep) for sp in map(os.path.abspath, key)
+        )
+        _sys_path_key = key
+    return _sys_path_cache
+
+
+def _module_path_for_file(caller_file):
+    """
+    Map 'caller_file' to its dotted module path relative to the
+    longest matching sys.path entry. Memoized until sys.path changes.
+    """
+    caller_file = os.path.abspath(caller_file)
+    prefixes = _sys_path_prefixes()
+    entry = _module_path_cache.get(caller_file)
+    if entry is not None and entry[0] is prefixes:
+        return entry[1]
+
+    best_base = None
+    rel_mod = None
+    for sp, sp_prefix in prefixes:
+        if not caller_file.startswith(sp_prefix) and caller_file != sp:
+            continue
+        if best_base is None or len(sp) > len(best_base):
+            best_base = sp
+            rel = os.path.relpath(caller_file, sp)
+            rel_mod = rel
+
+    if rel_mod is None:
+        raise RuntimeError(
+            "Could not map the caller file to an importable module.\n"
+            "Ensure your project root is on PYTHONPATH or run from the package root."
+        )
+
+    rel_mod = rel_mod.replace(os.sep, ".")
+    if rel_mod.endswith(".py"):
+        rel_mod = rel_mod[:-3]
+    if rel_mod.endswith(".__init__"):
+        rel_mod = rel_mod[: -len(".__init__")]
+
+    _module_path_cache[caller_file] = (prefixes, rel_mod)
+    return rel_mod
+
+
 def _import_string(self) -> str:
-    caller_frame = inspect.stack()[2].frame
+    caller_frame = sys._getframe(2)
     g = caller_frame.f_globals
 
     caller_name = g.get("__name__", None)
@@ -613,31 +952,7 @@ def _import_string(self) -> str:
                 "Cannot infer import string: caller __file__ not available. "
                 "Run from a regular Python module (not an interactive shell)."
             )
-        caller_file = os.path.abspath(caller_file)
-
-        best_base = None
-        rel_mod = None
-        for sp in map(os.path.abspath, sys.path):
-            if not caller_file.startswith(sp + os.sep) and caller_file != sp:
-                continue
-            if best_base is None or len(sp) > len(best_base):
-                best_base = sp
-                rel = os.path.relpath(caller_file, sp)
-                rel_mod = rel
-
-        if rel_mod is None:
-            raise RuntimeError(
-                "Could not map the caller file to an importable module.\n"
-                "Ensure your project root is on PYTHONPATH or run from the package root."
-            )
-
-        rel_mod = rel_mod.replace(os.sep, ".")
-        if rel_mod.endswith(".py"):
-            rel_mod = rel_mod[:-3]
-        if rel_mod.endswith(".__init__"):
-            rel_mod = rel_mod[: -len(".__init__")]
-
-        module_path = rel_mod
+        module_path = _module_path_for_file(caller_file)
 
     return f"{module_path}:{var_name}"
 
@@ -1,32 +1,65 @@
+import sys
 import logging
-import inspect
+import functools
 from utils.general import message as _message
+from api.mods import helper as _helper
 
 ROUTER_COL_WIDTH = 11
 LOGGER_NAME = "api"
 CLIENT_LEVEL = logging.INFO + 1
 logging.addLevelName(CLIENT_LEVEL, "CLIENT")
+_app_logger = None
+_routers_by_globals = {}
+_router_names_by_code = {}
+_UNSET = object()
 
 class Formatter(logging.Formatter):
     def __init__(self, datefmt=None):
         super().__init__(datefmt=datefmt or "%Y-%m-%d %H:%M:%S")
+        self._time_cache = (None, "")
+
+    def formatTime(self, record, datefmt=None):
+        """
+        The date format has second resolution, so the formatted time is
+        reused for every record created within the same second.
+        """
+        key = (int(record.created), datefmt)
+        cached_key, cached = self._time_cache
+        if key == cached_key:
+            return cached
+        formatted = super().formatTime(record, datefmt)
+        self._time_cache = (key, formatted)
+        return formatted
 
     def format(self, record):
         level_field = f"{record.levelname}:".ljust(8)
         dt = self.formatTime(record, self.datefmt)
         msg = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            return f"{level_field} {dt} {msg}\n{record.exc_text}"
         return f"{level_field} {dt} {msg}"
 
 
 def _get_app_logger():
-    logger = logging.getLogger(LOGGER_NAME)
-    if not logger.handlers:
-        handler = logging.StreamHandler()
-        handler.setFormatter(Formatter())
-        logger.addHandler(handler)
-        logger.setLevel(logging.DEBUG)
-        logger.propagate = False
-    return logger
+    global _app_logger
+    if _app_logger is None:
+        logger = logging.getLogger(LOGGER_NAME)
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(Formatter())
+            logger.addHandler(handler)
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+        _app_logger = logger
+    return _app_logger
+
+
+def _register_router(router, module_globals):
+    """Record 'router' as the router of the module owning 'module_globals'."""
+    _routers_by_globals.setdefault(id(module_globals), router)
+    _router_names_by_code.clear()
 
 
 def _truncate_router_name(name, maxlen):
@@ -38,11 +71,12 @@ def _truncate_router_name(name, maxlen):
 
 
 def _build_prefix(router_name=None):
-    from api.mods.helper import _api_name
+    return _format_prefix(_helper._api_name or "api", router_name or "")
+
 
-    api_name = _api_name or "api"
+@functools.lru_cache(maxsize=256)
+def _format_prefix(api_name, label):
     api_part = f"[{api_name}]"
-    label = router_name or ""
     if label:
         label = _truncate_router_name(label, ROUTER_COL_WIDTH)
         router_bracket = f"[{label}]"
@@ -55,40 +89,56 @@ def _build_prefix(router_name=None):
     return f"{api_part} {router_part} "
 
 
+def _lookup_router_name(module_globals):
+    router = _routers_by_globals.get(id(module_globals))
+    if router is not None:
+        name = getattr(router, "name", None)
+        if name:
+            return name
+
+    R = _helper._get_router_class()
+    try:
+        for v in module_globals.values():
+            if isinstance(v, R):
+                name = getattr(v, "name", None)
+                if name:
+                    return name
+    except Exception:
+        return None
+    return None
+
+
 class Logger:
     def __init__(self, base_logger=LOGGER_NAME):
         self._base_logger = base_logger
 
     def _caller_router_name(self):
         try:
-            frame = inspect.stack()[3].frame
-        except Exception:
+            frame = sys._getframe(3)
+        except ValueError:
             frame = None
 
         if frame is None:
             return None
 
-        from api.mods.helper import _get_router_class
-        R = _get_router_class()
+        code = frame.f_code
         try:
-            for v in frame.f_globals.values():
-                if isinstance(v, R):
-                    name = getattr(v, "name", None)
-                    if name:
-                        return name
-        except Exception:
-            return None
-        return None
-
-    def _log(self, level, message, router_name=None, **kwargs):
-        try:
-            logger = _get_app_logger()
-            router = router_name or self._caller_router_name()
-            prefix = _build_prefix(router)
-            message = _message(message=message, **kwargs)
-            logger.log(level, prefix + message)
-        except Exception:
+            return _router_names_by_code[code]
+        except KeyError:
             pass
+        name = _lookup_router_name(frame.f_globals)
+        _router_names_by_code[code] = name
+        return name
+
+    def _log(self, level, message, router_name=_UNSET, **kwargs):
+        logger = _get_app_logger()
+        if not logger.isEnabledFor(level):
+            return
+        if router_name is _UNSET:
+            router_name = self._caller_router_name()
+        prefix = _build_prefix(router_name)
+        message = _message(message=message, **kwargs)
+        logger.log(level, "%s%s", prefix, message)
 
     def debug(self, message, **kwargs):
         self._log(logging.DEBUG, message, **kwargs)
@@ -110,7 +160,7 @@ class Logger:
         self._log(logging.CRITICAL, message, **kwargs)
 
     def client(self, message, **kwargs):
-        router_name = kwargs.pop("router_name", None)
+        router_name = kwargs.pop("router_name", _UNSET)
         self._log(CLIENT_LEVEL, message, router_name=router_name, **kwargs)
 
 log = Logger()
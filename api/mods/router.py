@@ -1,9 +1,12 @@
+import sys
 from system import Component
 from api.mods.handler import route, GET, POST, PUT, PATCH, DELETE
+from api.mods.log import _register_router
 
 class Router(Component):
     def __init__(self, path="/", name="router", desc=""):
         super().__init__(name=name, desc=desc, prefix=path)
+        _register_router(self, sys._getframe(1).f_globals)
 
 Router.attach(handler=route,  name="router")
 Router.attach(handler=GET,    name="GET")
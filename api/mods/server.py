@@ -1,7 +1,24 @@
+import os
+import sys
+import socket
 import asyncio
-import traceback
+import logging
+import multiprocessing
 from urllib.parse import urlsplit
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+_logger = logging.getLogger(__name__)
+
+# raised when the client goes away mid-request or mid-response
+_DISCONNECT_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+
+MAX_HEADER_BYTES = 16384
+MAX_HEADERS = 100
+
 _STATUS_REASONS = {
     200: "OK",
     201: "Created",
@@ -14,217 +31,379 @@ _STATUS_REASONS = {
     404: "Not Found",
     405: "Method Not Allowed",
     413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
     500: "Internal Server Error",
+    501: "Not Implemented",
     502: "Bad Gateway",
     503: "Service Unavailable",
 }
 
+_STATUS_LINES = {
+    status: f"HTTP/1.1 {status} {reason}\r\n".encode("ascii")
+    for status, reason in _STATUS_REASONS.items()
+}
+
+
+_COMMON_HEADERS = (
+    b"host", b"user-agent", b"accept", b"accept-encoding",
+    b"accept-language", b"connection", b"content-length", b"content-type",
+    b"cookie", b"authorization", b"x-api-token", b"origin", b"referer",
+    b"cache-control", b"x-forwarded-for",
+)
+# canonical lowercase name for the usual spellings of common headers
+_HEADER_NAMES = {
+    spelling: name
+    for name in _COMMON_HEADERS
+    for spelling in (name, name.title(), name.upper())
+}
+
+_ASGI_INFO = {"version": "3.0", "spec_version": "2.3"}
+_HTTP_VERSIONS = {"HTTP/1.1": "1.1", "HTTP/1.0": "1.0"}
+
+
+def _status_line(status):
+    line = _STATUS_LINES.get(status)
+    if line is None:
+        line = f"HTTP/1.1 {status} Unknown\r\n".encode("ascii")
+    return line
+
+
+def _connection_tokens(value):
+    """Lowercased tokens of a comma-separated Connection header value."""
+    if not value:
+        return ()
+    return [token.strip() for token in value.lower().split(b",")]
+
+
+def _split_target(target):
+    """
+    Split a request target into (path, query). Origin-form targets
+    ('/path?query') are split directly; anything else goes through
+    urlsplit.
+    """
+    if target[:1] == "/" and target[1:2] != "/" and "#" not in target:
+        path, _, query = target.partition("?")
+        return path, query
+    parsed_url = urlsplit(target)
+    return parsed_url.path or "/", parsed_url.query or ""
+
+
+def _simple_response(status, body):
+    """Complete plain-text response that closes the connection."""
+    return (
+        _status_line(status)
+        + b"Content-Length: %d\r\n" % len(body)
+        + b"Content-Type: text/plain; charset=utf-8\r\n"
+        + b"Connection: close\r\n"
+        + b"\r\n"
+        + body
+    )
+
+
+_RESP_400_EMPTY_LINE = _simple_response(400, b"Bad Request: empty request line")
+_RESP_400_BAD_LINE = _simple_response(400, b"Bad Request: invalid request line")
+_RESP_400_BAD_CL = _simple_response(400, b"Bad Request: invalid Content-Length")
+_RESP_431 = _simple_response(431, b"Request Header Fields Too Large")
+_RESP_500 = _simple_response(500, b"Internal Server Error")
+_RESP_501_TE = _simple_response(501, b"Not Implemented: Transfer-Encoding")
+
+
+class _ASGICycle:
+    """
+    Per-request ASGI 'receive'/'send' pair for a single connection.
+    """
+    __slots__ = (
+        "writer", "body", "request_sent", "disconnected",
+        "response_started", "response_ended", "head", "keep_alive",
+        "http10", "head_only",
+    )
+
+    def __init__(self, writer, body, keep_alive=False, http10=False, head_only=False):
+        self.writer = writer
+        self.body = body
+        self.keep_alive = keep_alive
+        self.http10 = http10
+        # HEAD responses carry headers only; any body would be read as
+        # the start of the next response on a persistent connection
+        self.head_only = head_only
+        self.request_sent = False
+        self.disconnected = False
+        self.response_started = False
+        self.response_ended = False
+        self.head = None
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {
+                "type": "http.request",
+                "body": self.body,
+                "more_body": False,
+            }
+        if not self.disconnected:
+            self.disconnected = True
+            return {"type": "http.disconnect"}
+        await asyncio.sleep(0)
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if self.response_ended:
+            return
+
+        msg_type = message.get("type")
+        writer = self.writer
+
+        if msg_type == "http.response.start":
+            if self.response_started:
+                raise RuntimeError("Response already started")
+
+            status = int(message["status"])
+            status_line = _status_line(status)
+
+            msg_headers = message.get(
+                "headers", []
+            )
+
+            parts = [status_line]
+            append = parts.append
+            framed = False
+            connection = None
+            for name, value in msg_headers:
+                lowered = name.lower()
+                if lowered == b"content-length":
+                    framed = True
+                elif lowered == b"connection":
+                    connection = _connection_tokens(value)
+                append(name)
+                append(b": ")
+                append(value)
+                append(b"\r\n")
+            # without a Content-Length the body is delimited by closing
+            if not framed or (connection is not None and b"close" in connection):
+                self.keep_alive = False
+            if connection is None:
+                if not self.keep_alive:
+                    append(b"connection: close\r\n")
+                elif self.http10:
+                    append(b"connection: keep-alive\r\n")
+            append(b"\r\n")
+            # held back so it can go out together with the first body chunk
+            self.head = b"".join(parts)
+            self.response_started = True
+
+        elif msg_type == "http.response.body":
+            if not self.response_started:
+                await self.send(
+                    {
+                        "type": "http.response.start",
+                        "status": 200,
+                        "headers": [],
+                    }
+                )
+
+            body = message.get("body", b"")
+            more_body = bool(message.get("more_body", False))
+            if self.head_only:
+                body = b""
+
+            head = self.head
+            if head is not None:
+                self.head = None
+                if body:
+                    writer.writelines((head, body))
+                else:
+                    writer.write(head)
+            elif body:
+                writer.write(body)
+
+            if more_body:
+                await writer.drain()
+            elif self.keep_alive:
+                self.response_ended = True
+                await writer.drain()
+            else:
+                # close() flushes whatever is still buffered
+                self.response_ended = True
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+
+
 class BuiltinHTTPServer:
-    def __init__(self, app, host="127.0.0.1", port=8000):
+    def __init__(self, app, host="127.0.0.1", port=8000, keep_alive_timeout=5.0, reuse_port=False):
         self.app = app
         self.host = host
         self.port = port
+        self.keep_alive_timeout = keep_alive_timeout
+        self.reuse_port = reuse_port
         self._server = None
 
     async def _handle_client(self, reader, writer):
         try:
-            try:
-                header_data = await reader.readuntil(b"\r\n\r\n")
-            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
-                writer.close()
-                await writer.wait_closed()
-                return
-
-            header_text = header_data.decode("iso-8859-1")
-            lines = header_text.split("\r\n")
-            if not lines or not lines[0]:
-                await self._send_simple_response(
-                    writer, 400, b"Bad Request: empty request line"
-                )
-                return
-
-            request_line = lines[0]
-            header_lines = lines[1:-2] if lines[-2:] == ["", ""] else lines[1:]
-
-            try:
-                method, target, http_version = request_line.split(" ", 2)
-            except ValueError:
-                await self._send_simple_response(
-                    writer, 400, b"Bad Request: invalid request line"
-                )
-                return
-
-            # ---- Parse path / query ----
-            parsed_url = urlsplit(target)
-            path = parsed_url.path or "/"
-            raw_path = path.encode("ascii", "ignore")
-            query_string = (parsed_url.query or "").encode("ascii", "ignore")
-
-            # ---- Parse headers ----
-            headers=[]
-            headers_dict={}
-            for line in header_lines:
-                if not line:
-                    continue
-                if ":" not in line:
-                    continue
-                name, value = line.split(":", 1)
-                name = name.strip()
-                value = value.strip()
-                headers.append(
-                    (name.lower().encode("ascii", "ignore"),
-                     value.encode("utf-8", "ignore"))
-                )
-                headers_dict[name.lower()] = value
-
-            # ---- Read body (Content-Length only) ----
-            body = b""
-            if "content-length" in headers_dict:
-                try:
-                    length = int(headers_dict["content-length"])
-                except ValueError:
-                    await self._send_simple_response(
-                        writer, 400, b"Bad Request: invalid Content-Length"
-                    )
-                    return
-                if length > 0:
-                    body = await reader.readexactly(length)
-
-            # ---- Build ASGI scope ----
             client_addr = writer.get_extra_info("peername")
             server_addr = writer.get_extra_info("sockname")
 
-            client_host, client_port = None, None
+            client = (None, None)
             if isinstance(client_addr, tuple):
-                client_host, client_port = client_addr[0], client_addr[1]
+                client = (client_addr[0], client_addr[1])
 
-            server_host, server_port = None, None
+            server = (None, None)
             if isinstance(server_addr, tuple):
-                server_host, server_port = server_addr[0], server_addr[1]
-
-            scope = {
-                "type": "http",
-                "asgi": {"version": "3.0", "spec_version": "2.3"},
-                "http_version": http_version.replace("HTTP/", ""),
-                "method": method,
-                "scheme": "http",
-                "path": path,
-                "raw_path": raw_path,
-                "query_string": query_string,
-                "headers": headers,
-                "client": (client_host, client_port),
-                "server": (server_host, server_port),
-            }
+                server = (server_addr[0], server_addr[1])
 
-            request_body = body
-            request_sent = False
-            disconnected = False
-
-            async def receive():
-                nonlocal request_sent, disconnected
-                if not request_sent:
-                    request_sent = True
-                    return {
-                        "type": "http.request",
-                        "body": request_body,
-                        "more_body": False,
-                    }
-                if not disconnected:
-                    disconnected = True
-                    return {"type": "http.disconnect"}
-                await asyncio.sleep(0)
-                return {"type": "http.disconnect"}
-
-            response_started = False
-            response_ended = False
-
-            async def send(message):
-                nonlocal response_started, response_ended
-
-                if response_ended:
+            first = True
+            while True:
+                try:
+                    if first:
+                        header_data = await reader.readuntil(b"\r\n\r\n")
+                    else:
+                        header_data = await asyncio.wait_for(
+                            reader.readuntil(b"\r\n\r\n"),
+                            self.keep_alive_timeout,
+                        )
+                except asyncio.LimitOverrunError:
+                    await self._send_raw_response(writer, _RESP_431)
                     return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    writer.close()
+                    await writer.wait_closed()
+                    return
+                first = False
 
-                msg_type = message.get("type")
+                lines = header_data[:-4].split(b"\r\n")
+                if len(lines) > MAX_HEADERS + 1:
+                    await self._send_raw_response(writer, _RESP_431)
+                    return
+                request_line = lines[0]
+                if not request_line:
+                    await self._send_raw_response(writer, _RESP_400_EMPTY_LINE)
+                    return
 
-                if msg_type == "http.response.start":
-                    if response_started:
-                        raise RuntimeError("Response already started")
+                try:
+                    method, target, http_version = request_line.decode(
+                        "iso-8859-1"
+                    ).split(" ", 2)
+                except ValueError:
+                    await self._send_raw_response(writer, _RESP_400_BAD_LINE)
+                    return
 
-                    status = int(message["status"])
-                    reason = _STATUS_REASONS.get(status, "Unknown")
-                    status_line = f"HTTP/1.1 {status} {reason}\r\n"
+                # ---- Parse path / query ----
+                path, query = _split_target(target)
+                raw_path = path.encode("ascii", "ignore")
+                query_string = query.encode("ascii", "ignore")
+
+                # ---- Parse headers ----
+                headers = []
+                content_length = connection = None
+                chunked = conflicting_length = False
+                for line in lines[1:]:
+                    name, sep, value = line.partition(b":")
+                    if not sep:
+                        continue
+                    name = _HEADER_NAMES.get(name) or name.strip().lower()
+                    value = value.strip()
+                    headers.append((name, value))
+                    if name == b"content-length":
+                        if content_length is not None and content_length != value:
+                            conflicting_length = True
+                        content_length = value
+                    elif name == b"connection":
+                        connection = value
+                    elif name == b"transfer-encoding":
+                        chunked = True
+
+                # A body we cannot frame would be read as the next request
+                # on a persistent connection, so refuse it outright.
+                if chunked:
+                    await self._send_raw_response(writer, _RESP_501_TE)
+                    return
+                if conflicting_length:
+                    await self._send_raw_response(writer, _RESP_400_BAD_CL)
+                    return
 
-                    msg_headers = message.get(
-                        "headers", []
+                # ---- Read body (Content-Length only) ----
+                body = b""
+                if content_length is not None:
+                    # plain ASCII digits only: no sign, spaces or underscores
+                    if not content_length.isdigit():
+                        await self._send_raw_response(writer, _RESP_400_BAD_CL)
+                        return
+                    length = int(content_length)
+                    if length > 0:
+                        body = await reader.readexactly(length)
+
+                # ---- Connection persistence ----
+                tokens = _connection_tokens(connection)
+                if http_version == "HTTP/1.1":
+                    keep_alive = b"close" not in tokens
+                else:
+                    keep_alive = (
+                        b"keep-alive" in tokens and b"close" not in tokens
                     )
 
-                    header_bytes = status_line.encode("ascii")
-                    for name, value in msg_headers:
-                        header_bytes += name + b": " + value + b"\r\n"
-
-                    header_bytes += b"\r\n"
-                    writer.write(header_bytes)
-                    response_started = True
-
-                elif msg_type == "http.response.body":
-                    if not response_started:
-                        await send(
-                            {
-                                "type": "http.response.start",
-                                "status": 200,
-                                "headers": [],
-                            }
-                        )
-
-                    body = message.get("body", b"")
-                    more_body = bool(message.get("more_body", False))
-
-                    if body:
-                        writer.write(body)
+                # ---- Build ASGI scope ----
+                scope = {
+                    "type": "http",
+                    "asgi": _ASGI_INFO,
+                    "http_version": _HTTP_VERSIONS.get(http_version)
+                    or http_version.replace("HTTP/", ""),
+                    "method": method,
+                    "scheme": "http",
+                    "path": path,
+                    "raw_path": raw_path,
+                    "query_string": query_string,
+                    "headers": headers,
+                    "client": client,
+                    "server": server,
+                }
+
+                cycle = _ASGICycle(
+                    writer, body, keep_alive, http_version != "HTTP/1.1",
+                    method == "HEAD",
+                )
 
-                    if not more_body:
-                        await writer.drain()
-                        response_ended = True
-                        writer.close()
-                        try:
-                            await writer.wait_closed()
-                        except Exception:
-                            pass
+                try:
+                    await self.app(scope, cycle.receive, cycle.send)
+                except _DISCONNECT_ERRORS:
+                    writer.close()
+                    return
+                except Exception:
+                    _logger.exception("Unhandled error in ASGI app")
+                    if not writer.is_closing():
+                        if not cycle.response_started:
+                            await self._send_raw_response(writer, _RESP_500)
+                        else:
+                            writer.close()
+                            try:
+                                await writer.wait_closed()
+                            except Exception:
+                                pass
+                    return
 
-            try:
-                await self.app(scope, receive, send)
-            except Exception:
-                traceback.print_exc()
-                if not writer.is_closing():
-                    if not response_started:
-                        await self._send_simple_response(
-                            writer, 500, b"Internal Server Error"
-                        )
-                    else:
+                if not cycle.response_ended or writer.is_closing():
+                    if not writer.is_closing():
                         writer.close()
                         try:
                             await writer.wait_closed()
                         except Exception:
                             pass
+                    return
 
+        except _DISCONNECT_ERRORS:
+            # the client went away mid-request; nothing worth reporting
+            writer.close()
         except Exception:
-            traceback.print_exc()
+            _logger.exception("Error while handling connection")
             try:
                 writer.close()
                 await writer.wait_closed()
             except Exception:
                 pass
 
-    async def _send_simple_response(self, writer, status, body):
-        reason = _STATUS_REASONS.get(status, "Unknown")
-        status_line = f"HTTP/1.1 {status} {reason}\r\n"
-        headers = (
-            f"Content-Length: {len(body)}\r\n"
-            f"Content-Type: text/plain; charset=utf-8\r\n"
-            f"Connection: close\r\n"
-            f"\r\n"
-        )
-        writer.write(status_line.encode("ascii") + headers.encode("ascii") + body)
+    async def _send_raw_response(self, writer, data):
+        writer.write(data)
         await writer.drain()
         writer.close()
         try:
@@ -234,7 +413,9 @@ class BuiltinHTTPServer:
 
     async def serve_forever(self):
         self._server = await asyncio.start_server(
-            self._handle_client, self.host, self.port
+            self._handle_client, self.host, self.port,
+            limit=MAX_HEADER_BYTES,
+            reuse_port=self.reuse_port,
         )
         addrs = ", ".join(str(sock.getsockname()) for sock in self._server.sockets)
         print(f"Serving on {addrs}")
@@ -242,6 +423,58 @@ class BuiltinHTTPServer:
             await self._server.serve_forever()
 
 
-def run(app, host="127.0.0.1", port=8000):
-    server = BuiltinHTTPServer(app, host=host, port=port)
-    asyncio.run(server.serve_forever())
+def _serve(app, host, port, reuse_port=False):
+    server = BuiltinHTTPServer(app, host=host, port=port, reuse_port=reuse_port)
+    if uvloop is not None and hasattr(uvloop, "run"):
+        uvloop.run(server.serve_forever())
+    else:
+        if uvloop is not None:
+            # uvloop < 0.18 has no uvloop.run()
+            uvloop.install()
+        asyncio.run(server.serve_forever())
+
+
+def run(app, host="127.0.0.1", port=8000, workers=1):
+    """
+    Serve 'app' on host:port. With workers > 1 (or None for one per
+    CPU), that many forked processes bind the same port through
+    SO_REUSEPORT and the kernel balances connections between them.
+    Multi-worker mode is Linux-only: elsewhere SO_REUSEPORT does not
+    balance connections and fork is unsafe, so a single process serves.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and not port:
+        raise ValueError("workers > 1 needs a fixed port, not an ephemeral one")
+
+    if workers > 1 and not (
+        sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+    ):
+        _logger.warning(
+            "Multiple workers are only supported on Linux; serving with one process."
+        )
+        workers = 1
+
+    if workers <= 1:
+        _serve(app, host, port)
+        return
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [
+        ctx.Process(target=_serve, args=(app, host, port, True), daemon=True)
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in procs:
+            proc.join()